@@ -1,6 +1,5 @@
 import requests
 from pydantic import BaseModel
-from decimal import Decimal
 
 
 class NeoNetworkConfig(BaseModel):
@@ -8,8 +7,16 @@ class NeoNetworkConfig(BaseModel):
     flamingo_api: str = "https://api.flamingo.finance"
     relay_contract_hash: str = "0x1a2b3c...def"  # GaslessRelay
     agent_wallet_wif: str = "L4nZC5YBZ4PzU1JHb4YSDH25UyL8n8826hN297w2L7J8K9L9M9N9"  # приватный ключ агента (хранить в секрете!)
-    min_agent_gas_balance: Decimal = Decimal("0.001")  # минимальный буфер GAS у агента
+    min_agent_gas_balance: float = 0.001  # минимальный буфер GAS у агента
     slippage_bps: int = 50  # 0.5%
+    valid_until_block_increment: int = 100  # блоков жизни транзакции после текущей высоты
+    price_cache_ttl: float = 3.0  # секунд кэширования курса Flamingo
+    gas_balance_cache_ttl: float = 15.0  # секунд кэширования баланса GAS агента (~1 блок)
+    intent_cache_size: int = 10_000  # сколько результатов переводов помнить для ретраев
+    intent_cache_ttl: float = 300.0  # секунд хранения результата перевода по intent_id
+    gas_topup_interval: float = 30.0  # секунд между фоновыми проверками баланса GAS агента
+    rpc_concurrency: int = 32  # максимум одновременных RPC-запросов к ноде
+    http_pool_limit: int = 100  # максимум одновременных HTTP-соединений к RPC-ноде
 
 
 # This is a sample Python script.
@@ -1,12 +1,34 @@
 import asyncio
-from typing import Dict, Any
-from pydantic import BaseModel
+import contextlib
+from typing import Optional
+from pydantic import BaseModel, ConfigDict
 from fastmcp import FastMCP
 from fastmcp.transport import HTTPTransport
 from fastmcp.types import ToolCall, ToolResponse
 from config import NeoNetworkConfig
 from tools.gasless_relay import GaslessRelayTool
 
+
+class EstimateGasParams(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    asset_symbol: str = "NEO"
+    fee_gas: float = 0.00012
+    intent_id: Optional[str] = None
+
+
+class ExecuteGaslessParams(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
+    from_addr: str
+    to_addr: str
+    asset_hash: str
+    gross_amount: int
+    fee_in_asset: int
+    user_signature: str
+    intent_id: str
+
+
 async def main():
     config = NeoNetworkConfig(
         # ... ваша конфигурация
@@ -22,50 +44,30 @@ async def main():
     @mcp.tool(
         name="estimate_gas_cost",
         description="Estimate fee in native asset (e.g. NEO) for gasless transfer",
-        parameters={
-            "type": "object",
-            "properties": {
-                "asset_symbol": {"type": "string", "default": "NEO"},
-                "fee_gas": {"type": "number", "default": 0.00012},
-                "intent_id": {"type": "string", "nullable": True}
-            },
-            "required": []
-        }
+        parameters=EstimateGasParams.model_json_schema()
     )
-    async def estimate_gas_cost_tool(params: Dict[str, Any]) -> ToolResponse:
+    async def estimate_gas_cost_tool(params: EstimateGasParams) -> ToolResponse:
         result = await tool_instance.estimate_gas_cost(
-            asset_symbol=params.get("asset_symbol", "NEO"),
-            fee_gas=params.get("fee_gas", 0.00012),
-            intent_id=params.get("intent_id")
+            asset_symbol=params.asset_symbol,
+            fee_gas=params.fee_gas,
+            intent_id=params.intent_id
         )
         return ToolResponse(content=result)
 
     @mcp.tool(
         name="execute_gasless_transfer",
         description="Execute transfer with fee covered by burning part of amount",
-        parameters={
-            "type": "object",
-            "properties": {
-                "from_addr": {"type": "string"},
-                "to_addr": {"type": "string"},
-                "asset_hash": {"type": "string"},
-                "gross_amount": {"type": "integer"},
-                "fee_in_asset": {"type": "integer"},
-                "user_signature": {"type": "string"},
-                "intent_id": {"type": "string"}
-            },
-            "required": ["from_addr", "to_addr", "asset_hash", "gross_amount", "fee_in_asset", "user_signature", "intent_id"]
-        }
+        parameters=ExecuteGaslessParams.model_json_schema()
     )
-    async def execute_gasless_transfer_tool(params: Dict[str, Any]) -> ToolResponse:
+    async def execute_gasless_transfer_tool(params: ExecuteGaslessParams) -> ToolResponse:
         result = await tool_instance.execute_gasless_transfer(
-            from_addr=params["from_addr"],
-            to_addr=params["to_addr"],
-            asset_hash=params["asset_hash"],
-            gross_amount=params["gross_amount"],
-            fee_in_asset=params["fee_in_asset"],
-            user_signature=params["user_signature"],
-            intent_id=params["intent_id"]
+            from_addr=params.from_addr,
+            to_addr=params.to_addr,
+            asset_hash=params.asset_hash,
+            gross_amount=params.gross_amount,
+            fee_in_asset=params.fee_in_asset,
+            user_signature=params.user_signature,
+            intent_id=params.intent_id
         )
         return ToolResponse(content=result)
 
@@ -74,7 +76,21 @@ async def main():
         port=8000,
         path="/mcp"
     )
-    await mcp.start(transport)
+    await tool_instance.warmup()
+    topup_task = asyncio.create_task(tool_instance.gas_topup_loop())
+    try:
+        await mcp.start(transport)
+    finally:
+        # Дожидаемся остановки фоновой задачи, прежде чем закрывать её HTTP-клиенты
+        topup_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await topup_task
+        await tool_instance.aclose()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        import uvloop
+    except ImportError:  # uvloop не установлен (например, Windows) — стандартный loop
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
@@ -1,8 +1,13 @@
+import asyncio
+import hashlib
+import json
+import time
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 from decimal import Decimal
 
-from tools.gasless_relay import GaslessRelayTool
+from tools import gasless_relay
+from tools.gasless_relay import GaslessRelayTool, canonical_intent_bytes
 from config import NeoNetworkConfig
 
 
@@ -13,7 +18,7 @@ def config():
         flamingo_api="https://api.flamingo.finance",
         relay_contract_hash="0x1a2b3c...",
         agent_wallet_wif="L4nZC5YBZ4PzU1JHb4YSDH25UyL8n8826hN297w2L7J8K9L9M9N9",
-        min_agent_gas_balance=Decimal("0.001"),
+        min_agent_gas_balance=0.001,
         slippage_bps=50
     )
 
@@ -30,40 +35,219 @@ class TestGaslessRelayTool:
         ("FLM", "GAS", 0.3),
     ])
     def test_get_price_from_flamingo(self, tool, base, quote, expected_price):
-        with patch("requests.get") as mock_get:
-            mock_get.return_value.json.return_value = {"price": expected_price}
-            mock_get.return_value.raise_for_status.return_value = None
+        mock_resp = MagicMock()
+        mock_resp.json.return_value = {"price": expected_price}
+        mock_resp.raise_for_status.return_value = None
+        mock_http = MagicMock()
+        mock_http.get = AsyncMock(return_value=mock_resp)
 
-            price = tool._get_price_from_flamingo(base, quote)
+        with patch.object(tool, '_get_flamingo_http', return_value=mock_http):
+            price = asyncio.run(tool._get_price_from_flamingo(base, quote))
             assert price == expected_price
+            mock_http.get.assert_called_once_with(
+                "https://api.flamingo.finance/price", params={"pair": f"{base}_{quote}"}
+            )
+
+    @pytest.mark.parametrize("payload", [{}, {"price": 0}, {"price": -1.5}])
+    def test_get_price_from_flamingo_rejects_non_positive(self, tool, payload):
+        mock_resp = MagicMock()
+        mock_resp.json.return_value = payload
+        mock_resp.raise_for_status.return_value = None
+        mock_http = MagicMock()
+        mock_http.get = AsyncMock(return_value=mock_resp)
+
+        with patch.object(tool, '_get_flamingo_http', return_value=mock_http):
+            assert asyncio.run(tool._get_price_from_flamingo("NEO", "GAS")) is None
+            assert tool._price_cache == {}
+
+    def test_price_cache_drops_expired_entries(self, tool):
+        tool._price_cache[("OLD", "GAS")] = (1.0, time.monotonic() - tool.config.price_cache_ttl - 1)
+        with patch.object(tool, '_fetch_price_from_flamingo', AsyncMock(return_value=42.7)):
+            asyncio.run(tool._get_price_from_flamingo("NEO", "GAS"))
+        assert list(tool._price_cache) == [("NEO", "GAS")]
+
+    def test_get_price_from_flamingo_cached(self, tool):
+        with patch.object(tool, '_fetch_price_from_flamingo', AsyncMock(return_value=42.7)) as mock_fetch:
+            async def burst():
+                return await asyncio.gather(*(tool._get_price_from_flamingo("NEO", "GAS") for _ in range(10)))
+
+            prices = asyncio.run(burst())
+            assert prices == [42.7] * 10
+            assert asyncio.run(tool._get_price_from_flamingo("NEO", "GAS")) == 42.7
+            mock_fetch.assert_awaited_once_with("NEO", "GAS")
+
+    def test_get_price_from_flamingo_survives_cancelled_first_caller(self, tool):
+        async def slow_fetch(base, quote):
+            await asyncio.sleep(0.01)
+            return 42.7
+
+        with patch.object(tool, '_fetch_price_from_flamingo', side_effect=slow_fetch):
+            async def scenario():
+                first = asyncio.create_task(tool._get_price_from_flamingo("NEO", "GAS"))
+                await asyncio.sleep(0)
+                second = asyncio.create_task(tool._get_price_from_flamingo("NEO", "GAS"))
+                await asyncio.sleep(0)
+                first.cancel()  # например, MCP-клиент отключился
+                return await second
+
+            assert asyncio.run(scenario()) == 42.7
+            assert tool._price_cache[("NEO", "GAS")][0] == 42.7
 
     def test_estimate_gas_cost(self, tool):
-        with patch.object(tool, '_get_price_from_flamingo', return_value=42.7):
-            result = tool.estimate_gas_cost(asset_symbol="NEO", fee_gas=0.00012)
+        with patch.object(tool, '_get_price_from_flamingo', AsyncMock(return_value=42.7)):
+            result = asyncio.run(tool.estimate_gas_cost(asset_symbol="NEO", fee_gas=0.00012))
             assert "fee_in_asset" in result
             assert result["fee_in_asset"] > 0
             assert result["asset_decimals"] == 8
 
+    def test_estimate_gas_cost_matches_decimal(self, tool):
+        fee_gas, price = 0.00012, 42.7
+        exact = Decimal(str(fee_gas)) / Decimal(str(price))
+        exact += exact * Decimal(tool.config.slippage_bps) / 10000
+        expected = int((exact * 10**8).to_integral_value(rounding="ROUND_HALF_UP"))
+
+        with patch.object(tool, '_get_price_from_flamingo', AsyncMock(return_value=price)):
+            result = asyncio.run(tool.estimate_gas_cost(asset_symbol="NEO", fee_gas=fee_gas))
+            assert result["fee_in_asset"] == expected
+
     def test_get_gas_balance(self, tool):
         mock_script_hash = MagicMock()
-        with patch.object(tool.rpc_client, 'invoke_function') as mock_invoke:
+        with patch.object(tool.rpc_client, 'invoke_function', AsyncMock()) as mock_invoke:
             mock_invoke.return_value.state = (int(Decimal("0.001") * 10**8)).to_bytes(8, 'little')
-            balance = tool._get_gas_balance(mock_script_hash)
-            assert balance == Decimal("0.001")
+            balance = asyncio.run(tool._get_gas_balance(mock_script_hash))
+            assert isinstance(balance, float)
+            assert balance == 0.001
+
+    def test_get_gas_balance_rpc_failure_raises(self, tool):
+        with patch.object(tool.rpc_client, 'invoke_function', AsyncMock(side_effect=RuntimeError("rpc down"))):
+            with pytest.raises(RuntimeError):
+                asyncio.run(tool._get_gas_balance(MagicMock()))
+
+    def test_ensure_agent_has_gas_rpc_failure_no_swap(self, tool):
+        # Сбой RPC — не «нулевой баланс»: без swap и без записи в кэш
+        with patch.object(tool, '_get_gas_balance', AsyncMock(side_effect=RuntimeError("rpc down"))):
+            with patch.object(tool, '_swap_flm_to_gas', AsyncMock()) as mock_swap:
+                with pytest.raises(RuntimeError):
+                    asyncio.run(tool._ensure_agent_has_gas())
+                mock_swap.assert_not_awaited()
+        assert tool._gas_balance_cache is None
+        assert tool._gas_ok is False
 
     def test_ensure_agent_has_gas_enough(self, tool):
-        with patch.object(tool, '_get_gas_balance', return_value=Decimal("0.002")):
+        with patch.object(tool, '_get_gas_balance', AsyncMock(return_value=0.002)):
             # Should not call swap
-            with patch.object(tool, '_swap_flm_to_gas') as mock_swap:
-                tool._ensure_agent_has_gas()
-                mock_swap.assert_not_called()
+            with patch.object(tool, '_swap_flm_to_gas', AsyncMock()) as mock_swap:
+                asyncio.run(tool._ensure_agent_has_gas())
+                mock_swap.assert_not_awaited()
 
     def test_ensure_agent_has_gas_insufficient(self, tool):
-        with patch.object(tool, '_get_gas_balance', return_value=Decimal("0.0005")):
+        with patch.object(tool, '_get_gas_balance', AsyncMock(return_value=0.0005)):
             # Should call swap
-            with patch.object(tool, '_swap_flm_to_gas') as mock_swap:
-                tool._ensure_agent_has_gas()
-                mock_swap.assert_called_once()
+            with patch.object(tool, '_swap_flm_to_gas', AsyncMock()) as mock_swap:
+                asyncio.run(tool._ensure_agent_has_gas())
+                mock_swap.assert_awaited_once()
+
+    def test_ensure_agent_has_gas_single_swap(self, tool):
+        with patch.object(tool, '_get_gas_balance', AsyncMock(return_value=0.0005)):
+            with patch.object(tool, '_swap_flm_to_gas', AsyncMock()) as mock_swap:
+                async def burst():
+                    await asyncio.gather(*(tool._ensure_agent_has_gas() for _ in range(20)))
+
+                asyncio.run(burst())
+                mock_swap.assert_awaited_once()
+        # После swap баланс ещё не подтверждён: переводы продолжают проверять его сами
+        assert tool._gas_ok is False
+        assert tool._gas_balance_cache is None
+
+    def test_gas_ok_flag_tracks_balance(self, tool):
+        assert tool._gas_ok is False
+        with patch.object(tool, '_get_gas_balance', AsyncMock(return_value=0.0015)):
+            asyncio.run(tool._ensure_agent_has_gas())
+        assert tool._gas_ok is True
+        # Трата GAS ниже min_agent_gas_balance снова включает синхронную проверку
+        tool._debit_cached_gas_balance(100000)
+        assert tool._gas_ok is False
+
+    def test_agent_gas_balance_cached_and_debited(self, tool):
+        with patch.object(tool, '_get_gas_balance', AsyncMock(return_value=0.002)) as mock_balance:
+            async def scenario():
+                balances = await asyncio.gather(*(tool._get_agent_gas_balance() for _ in range(5)))
+                tool._debit_cached_gas_balance(100000)
+                return balances, await tool._get_agent_gas_balance()
+
+            balances, after_send = asyncio.run(scenario())
+            assert balances == [0.002] * 5
+            assert after_send == pytest.approx(0.001)
+            mock_balance.assert_awaited_once()
+
+    def test_estimate_system_fee_and_vub_batched(self, tool):
+        mock_resp = MagicMock()
+        mock_resp.raise_for_status.return_value = None
+        # Ответы batch могут прийти в любом порядке — сопоставляем по id
+        mock_resp.json = AsyncMock(return_value=[
+            {"jsonrpc": "2.0", "id": 2, "result": 4242},
+            {"jsonrpc": "2.0", "id": 1, "result": {"state": "HALT", "gasconsumed": "997775"}},
+        ])
+        mock_http = MagicMock()
+        mock_http.post.return_value.__aenter__ = AsyncMock(return_value=mock_resp)
+        mock_http.post.return_value.__aexit__ = AsyncMock(return_value=False)
+
+        with patch.object(tool, '_get_http', return_value=mock_http):
+            system_fee, valid_until_block = asyncio.run(tool._estimate_system_fee_and_vub(b'\x11'))
+            assert system_fee == 997775
+            assert valid_until_block == 4242 + tool.config.valid_until_block_increment
+            batch = mock_http.post.call_args.kwargs["json"]
+            assert [r["method"] for r in batch] == ["invokescript", "getblockcount"]
+
+    @pytest.mark.parametrize("responses", [
+        [{"jsonrpc": "2.0", "id": 1, "result": {"state": "FAULT", "gasconsumed": "997775",
+                                                 "exception": "ASSERT is executed with false result."}},
+         {"jsonrpc": "2.0", "id": 2, "result": 4242}],
+        [{"jsonrpc": "2.0", "id": 1, "error": {"code": -32603, "message": "Internal error"}},
+         {"jsonrpc": "2.0", "id": 2, "result": 4242}],
+    ])
+    def test_estimate_system_fee_and_vub_raises(self, tool, responses):
+        mock_resp = MagicMock()
+        mock_resp.raise_for_status.return_value = None
+        mock_resp.json = AsyncMock(return_value=responses)
+        mock_http = MagicMock()
+        mock_http.post.return_value.__aenter__ = AsyncMock(return_value=mock_resp)
+        mock_http.post.return_value.__aexit__ = AsyncMock(return_value=False)
+
+        with patch.object(tool, '_get_http', return_value=mock_http):
+            with pytest.raises(RuntimeError):
+                asyncio.run(tool._estimate_system_fee_and_vub(b'\x11'))
+
+    def test_rpc_client_uses_shared_session(self, tool):
+        async def check():
+            try:
+                return tool.rpc_client.session is tool._get_http()
+            finally:
+                await tool.aclose()
+
+        assert tool.rpc_client.url == tool.config.rpc_url
+        assert tool.rpc_client.timeout.total == 3.0
+        assert asyncio.run(check())
+
+    def test_sender_lock_serializes_and_is_released(self, tool):
+        order = []
+
+        async def transfer(addr, n):
+            async with tool._sender_lock(addr):
+                order.append(("start", addr, n))
+                await asyncio.sleep(0)
+                order.append(("end", addr, n))
+
+        async def scenario():
+            await asyncio.gather(transfer("addr-1", 1), transfer("addr-1", 2), transfer("addr-2", 3))
+
+        asyncio.run(scenario())
+        addr1 = [e for e in order if e[1] == "addr-1"]
+        assert addr1 == [("start", "addr-1", 1), ("end", "addr-1", 1),
+                         ("start", "addr-1", 2), ("end", "addr-1", 2)]
+        # После отпускания lock'и не копятся
+        assert tool._sender_locks == {}
+        assert tool._sender_lock_users == {}
 
     def test_build_relay_script(self, tool):
         script = tool._build_relay_script(
@@ -72,7 +256,7 @@ class TestGaslessRelayTool:
             asset_hash="0xef4073a0f2b305a3d2a8c4e8b6d5c736c7c7c7c7",
             net_amount=399_999_659,
             burn_amount=341,
-            intent_id="uuid-123"
+            intent_id_bytes=b"uuid-123"
         )
         # Проверим, что скрипт не пустой
         assert len(script) > 0
@@ -81,53 +265,190 @@ class TestGaslessRelayTool:
         # Например, 0x62 — это OpCode для SYSCALL
         assert 0x62 in script
 
+    @pytest.mark.parametrize("value", [-1, 0, 16, 17, -2, 127, 128, -128, -129, 341, 399_999_659, 2**63, -2**63 - 1])
+    def test_emit_pushint_matches_script_builder(self, value):
+        builder = gasless_relay.vm_builder.ScriptBuilder()
+        builder.emit_push(value)
+        buf = bytearray()
+        gasless_relay._emit_pushint(buf, value)
+        assert bytes(buf) == builder.to_array()
+
+    @pytest.mark.parametrize("length", [0, 8, 255, 256, 65535, 65536])
+    def test_emit_pushdata_matches_script_builder(self, length):
+        data = b"\x01" * length
+        builder = gasless_relay.vm_builder.ScriptBuilder()
+        builder.emit_push(data)
+        buf = bytearray()
+        gasless_relay._emit_pushdata(buf, data)
+        assert bytes(buf) == builder.to_array()
+
     def test_build_custom_witness(self, tool):
         witness = tool._build_custom_witness(
             user_addr="0xAb4b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b",
-            contract_hash_str="0x1a2b3c..."
+            contract_hash_str="0x1a2b3c...",
+            intent_id_bytes=b"uuid-123",
+            sig_bytes=bytes.fromhex("a1b2c3d4e5f6")
         )
         # Проверим, что witness не None
         assert witness is not None
         # Проверим, что verification_script не пустой
         assert len(witness.verification_script) > 0
-        # Проверим, что invocation_script может быть пустым (это нормально)
-        # assert len(witness.invocation_script) > 0 # Необязательно
+        # invocation_script несёт подпись пользователя для verify
+        assert bytes.fromhex("a1b2c3d4e5f6") in witness.invocation_script
+
+    def test_canonical_intent_bytes_keeps_signing_format(self):
+        intent_data = {
+            "to": "0x1234567890123456789012345678901234567890",
+            "from": "0xAb4b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b",
+            "gross_amount": 400_000_000,
+            "fee_in_asset": 341,
+            "intent_id": "uuid-123-ё"
+        }
+        # Клиенты подписывают именно этот формат — он должен совпадать байт-в-байт
+        assert canonical_intent_bytes(intent_data) == json.dumps(intent_data, sort_keys=True).encode()
+        assert canonical_intent_bytes(intent_data).startswith(b'{"fee_in_asset": 341, "from": ')
+        assert b'\\u0451' in canonical_intent_bytes(intent_data)
+
+    def test_base58check_encode(self):
+        # Известный вектор: нулевой hash160 с версией 0x00
+        assert gasless_relay._base58check_encode(b"\x00" * 21) == "1111111111111111111114oLvT2"
+
+    def test_script_to_address_matches_uint160(self):
+        from neo3.core import types
+        script = bytes.fromhex("0c21" + "02" + "11" * 32 + "4156e7b327")
+        h160 = hashlib.new('ripemd160', hashlib.sha256(script).digest()).digest()
+        assert gasless_relay.script_to_address(script) == types.UInt160(h160).to_address()
+        assert gasless_relay.script_to_address(script).startswith("N")
 
     def test_execute_gasless_transfer_success(self, tool):
+        from neo3.network import payloads
+
         # Подготовка
         from_addr = "0xAb4b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b"
         to_addr = "0x1234567890123456789012345678901234567890"
         asset_hash = "0xef4073a0f2b305a3d2a8c4e8b6d5c736c7c7c7c7"
         gross_amount = 400_000_000
         fee_in_asset = 341
-        user_signature = "a1b2c3d4e5f6..."
+        user_signature = "a1b2c3d4e5f6"
         intent_id = "uuid-123"
+        witness = payloads.Witness(invocation_script=b"", verification_script=b"\x11")
+        tool._gas_balance_cache = (0.01, time.monotonic())
+
+        with patch("neo3.crypto.signing.recover_public_key_from_signature") as mock_recover, \
+                patch("neo3.contracts.contract.Contract.create_signature_redeem_script", return_value=b"\x0c"), \
+                patch.object(gasless_relay, "script_to_address", return_value=from_addr), \
+                patch.object(tool, '_ensure_agent_has_gas', AsyncMock()) as mock_gas, \
+                patch.object(tool, '_build_relay_script', return_value=b'\x00' * 20) as mock_script, \
+                patch.object(tool, '_build_custom_witness', return_value=witness) as mock_witness, \
+                patch.object(tool, '_estimate_system_fee_and_vub', AsyncMock(return_value=(997775, 4342))), \
+                patch.object(tool.agent_acct, 'sign_tx') as mock_sign, \
+                patch.object(tool, '_send_raw_transaction', AsyncMock(return_value="0xdeadbeef")) as mock_send:
+            # Вызов
+            result = asyncio.run(tool.execute_gasless_transfer(
+                from_addr=from_addr,
+                to_addr=to_addr,
+                asset_hash=asset_hash,
+                gross_amount=gross_amount,
+                fee_in_asset=fee_in_asset,
+                user_signature=user_signature,
+                intent_id=intent_id
+            ))
+
+        # Проверка
+        assert result["status"] == "sent"
+        assert result["net_amount"] == gross_amount - fee_in_asset
+        assert result["txid"] == "0xdeadbeef"
 
-        with patch.object(tool, 'estimate_gas_cost', return_value={"fee_in_asset": fee_in_asset}):
-            with patch.object(tool, '_ensure_agent_has_gas'):
-                with patch.object(tool, '_build_relay_script', return_value=b'\x00' * 20):
-                    with patch.object(tool, '_build_custom_witness', return_value=MagicMock()):
-                        with patch.object(tool.agent_acct, 'sign_tx'):
-                            with patch.object(tool, '_send_raw_transaction', return_value="0xdeadbeef"):
-                                # Вызов
-                                result = tool.execute_gasless_transfer(
-                                    from_addr=from_addr,
-                                    to_addr=to_addr,
-                                    asset_hash=asset_hash,
-                                    gross_amount=gross_amount,
-                                    fee_in_asset=fee_in_asset,
-                                    user_signature=user_signature,
-                                    intent_id=intent_id
-                                )
-                                # Проверка
-                                assert result["status"] == "sent"
-                                assert result["net_amount"] == gross_amount - fee_in_asset
-                                assert result["txid"] == "0xdeadbeef"
+        # Подпись проверяется по каноническим байтам intent, байты кодируются один раз
+        intent_bytes, sig_bytes = mock_recover.call_args.args
+        assert intent_bytes == canonical_intent_bytes({
+            "from": from_addr, "to": to_addr, "gross_amount": gross_amount,
+            "fee_in_asset": fee_in_asset, "intent_id": intent_id
+        })
+        assert sig_bytes == bytes.fromhex(user_signature)
+        assert mock_script.call_args.kwargs["intent_id_bytes"] == b"uuid-123"
+        assert mock_witness.call_args.args[2:] == (b"uuid-123", sig_bytes)
+
+        # Баланс GAS ещё не подтверждён — проверяется синхронно
+        mock_gas.assert_awaited_once()
+
+        # Транзакция собрана из batch-оценки, подписана и отправлена
+        tx = mock_send.await_args.args[0]
+        mock_sign.assert_called_once_with(tx)
+        assert tx.system_fee == 997775
+        assert tx.valid_until_block == 4342
+        assert tx.nonce != 12345
+        assert tx.witnesses == [witness]
+
+        # Потраченный GAS списан из кэша, lock отправителя освобождён
+        assert tool._gas_balance_cache[0] == pytest.approx(0.01 - (997775 + 100000) / 1e8)
+        assert tool._sender_locks == {}
+
+    def test_execute_gasless_transfer_idempotent(self, tool):
+        sent = {"txid": "0xdeadbeef", "status": "sent", "intent_id": "uuid-123"}
+        kwargs = dict(
+            from_addr="0xAb4b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b",
+            to_addr="0x1234567890123456789012345678901234567890",
+            asset_hash="0xef4073a0f2b305a3d2a8c4e8b6d5c736c7c7c7c7",
+            gross_amount=400_000_000,
+            fee_in_asset=341,
+            user_signature="a1b2c3d4e5f6",
+            intent_id="uuid-123"
+        )
+        with patch.object(tool, '_execute_gasless_transfer', AsyncMock(return_value=sent)) as mock_exec:
+            async def retries():
+                concurrent = await asyncio.gather(*(tool.execute_gasless_transfer(**kwargs) for _ in range(3)))
+                return concurrent, await tool.execute_gasless_transfer(**kwargs)
+
+            concurrent, later = asyncio.run(retries())
+            assert concurrent == [sent] * 3
+            assert later == sent
+            mock_exec.assert_awaited_once()
+            # Ответы — независимые копии: правка одного не меняет кэш и другие ответы
+            concurrent[0]["status"] = "mutated"
+            later["txid"] = "0xmutated"
+            assert concurrent[1] == sent
+            assert asyncio.run(tool.execute_gasless_transfer(**kwargs)) == sent
+
+    def test_execute_gasless_transfer_idempotency_key_covers_intent_and_signature(self, tool):
+        kwargs = dict(
+            from_addr="0xAb4b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b",
+            to_addr="0x1234567890123456789012345678901234567890",
+            asset_hash="0xef4073a0f2b305a3d2a8c4e8b6d5c736c7c7c7c7",
+            gross_amount=400_000_000,
+            fee_in_asset=341,
+            user_signature="a1b2c3d4e5f6",
+            intent_id="uuid-123"
+        )
+        genuine = {"txid": "0xgenuine", "status": "sent", "intent_id": "uuid-123"}
+
+        async def execute(*args):
+            if args[5] == "deadbeef":  # поддельная подпись
+                await asyncio.sleep(0)
+                raise ValueError("Invalid user signature for intent")
+            return genuine if args[3] == 400_000_000 else {"txid": "0xother"}
+
+        with patch.object(tool, '_execute_gasless_transfer', side_effect=execute) as mock_exec:
+            async def scenario():
+                forged, real = await asyncio.gather(
+                    tool.execute_gasless_transfer(**{**kwargs, "user_signature": "deadbeef"}),
+                    tool.execute_gasless_transfer(**kwargs),
+                    return_exceptions=True
+                )
+                changed = await tool.execute_gasless_transfer(**{**kwargs, "gross_amount": 500_000_000})
+                return forged, real, changed
+
+            forged, real, changed = asyncio.run(scenario())
+            # Подделка не перехватывает настоящий запрос, а изменённый intent не получает старый результат
+            assert isinstance(forged, ValueError)
+            assert real == genuine
+            assert changed == {"txid": "0xother"}
+            assert mock_exec.call_count == 3
 
     def test_execute_gasless_transfer_invalid_signature(self, tool):
         with patch("neo3.crypto.signing.recover_public_key_from_signature", side_effect=ValueError):
             with pytest.raises(ValueError):
-                tool.execute_gasless_transfer(
+                asyncio.run(tool.execute_gasless_transfer(
                     from_addr="0xAb4b3c4d5e6f7a8b9c0d1e2f3a4b5c6d7e8f9a0b",
                     to_addr="0x1234567890123456789012345678901234567890",
                     asset_hash="0xef...",
@@ -135,4 +456,4 @@ class TestGaslessRelayTool:
                     fee_in_asset=341,
                     user_signature="invalid",
                     intent_id="uuid-123"
-                )
+                ))
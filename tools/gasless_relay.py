@@ -1,7 +1,15 @@
 import asyncio
-from typing import Dict, Any, Optional
+import base64
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import cached_property, lru_cache
+from typing import Callable, Dict, Any, Optional, Tuple
 from decimal import Decimal
-import requests
+import aiohttp
+import httpx
 from neo3.core import types
 from neo3.wallet import account
 from neo3.network import payloads
@@ -11,6 +19,114 @@ from neo3.crypto import signing
 from neo3.contracts import contract
 import json
 
+RELAY_METHOD_NAME = b"transferWithFeeFromAmount"
+NEO_ADDRESS_VERSION = b"\x35"  # версия адресов NEO N3
+_B58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+# Опкоды NeoVM для ручной сборки push-инструкций
+_OP_PUSHINT8 = 0x00   # PUSHINT8..PUSHINT256 = 0x00..0x05
+_OP_PUSH0 = 0x10      # PUSHM1..PUSH16 = 0x0F..0x20
+_OP_PUSHDATA1 = 0x0C
+_OP_PUSHDATA2 = 0x0D
+_OP_PUSHDATA4 = 0x0E
+
+
+def canonical_intent_bytes(intent_data: Dict[str, Any]) -> bytes:
+    """
+    Байты intent, которые подписывает пользователь: json.dumps(sort_keys=True)
+    с разделителями ", "/": " и ensure_ascii. Это формат протокола — не менять.
+    """
+    return json.dumps(intent_data, sort_keys=True).encode()
+
+
+def _base58check_encode(payload: bytes) -> str:
+    data = payload + hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    n = int.from_bytes(data, 'big')
+    out = []
+    while n:
+        n, r = divmod(n, 58)
+        out.append(_B58_ALPHABET[r])
+    pad = len(data) - len(data.lstrip(b"\x00"))
+    return "1" * pad + "".join(reversed(out))
+
+
+def script_to_address(script: bytes) -> str:
+    """Адрес NEO N3 для verification-скрипта: base58check(0x35 || ripemd160(sha256(script)))"""
+    h160 = hashlib.new('ripemd160', hashlib.sha256(script).digest()).digest()
+    return _base58check_encode(NEO_ADDRESS_VERSION + h160)
+
+
+def _emit_pushint(buf: bytearray, n: int):
+    """PUSHINT с минимальной шириной, как ScriptBuilder.emit_push(int)"""
+    if -1 <= n <= 16:
+        buf.append(_OP_PUSH0 + n)
+        return
+    size = (n + (n < 0)).bit_length() // 8 + 1
+    width_log2 = (size - 1).bit_length()  # 1, 2, 4, 8, 16, 32 байт
+    if width_log2 > 5:
+        raise ValueError(f"Integer too large for PUSHINT: {n}")
+    buf.append(_OP_PUSHINT8 + width_log2)
+    buf += n.to_bytes(1 << width_log2, 'little', signed=True)
+
+
+def _emit_pushdata(buf: bytearray, data: bytes):
+    """PUSHDATA1/2/4 с префиксом длины, как ScriptBuilder.emit_push(bytes)"""
+    length = len(data)
+    if length < 0x100:
+        buf.append(_OP_PUSHDATA1)
+        buf.append(length)
+    elif length < 0x10000:
+        buf.append(_OP_PUSHDATA2)
+        buf += length.to_bytes(2, 'little')
+    else:
+        buf.append(_OP_PUSHDATA4)
+        buf += length.to_bytes(4, 'little')
+    buf += data
+
+
+def _emit_uint160(buf: bytearray, u: types.UInt160):
+    _emit_pushdata(buf, u.to_array())
+
+
+@lru_cache(maxsize=None)
+def verify_call_tail(contract_hash_str: str) -> bytes:
+    """
+    Неизменный хвост verification_script: вызов GaslessRelay.verify через
+    System.Contract.Call и ASSERT. Зависит только от хэша контракта.
+    """
+    builder = vm_builder.ScriptBuilder()
+    builder.emit_push("verify".encode('utf-8'))
+    builder.emit_push(contract_hash_str.encode('utf-8'))
+    builder.emit_push(0)  # CallFlags
+    builder.emit_push(3)  # num args: user, sig, intent
+    builder.emit(vm_builder.OpCode.PACK)
+    builder.emit_syscall("System.Contract.Call")
+    builder.emit(vm_builder.OpCode.ASSERT)
+    return builder.to_array()
+
+
+class PooledNeoRpcClient(noderpc.NeoRpcClient):
+    """
+    NeoRpcClient поверх общей aiohttp-сессии инструмента: keep-alive пул соединений
+    и DNS-кэш переиспользуются между RPC-вызовами вместо нового TLS на каждый запрос.
+    """
+
+    def __init__(self, url: str, session_factory: Callable[[], aiohttp.ClientSession], timeout: float = 3.0):
+        # super().__init__ не вызываем: он создаёт собственную ClientSession, а вне event loop
+        # это падает (aiohttp 3.10). Выставляем те же атрибуты, что RPCClient в neo-mamba 2.7.0
+        self.url = url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session_factory = session_factory
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._session_factory()
+
+    async def close(self):
+        # Сессией владеет GaslessRelayTool (см. aclose)
+        pass
+
+
 class GaslessRelayTool:
     """
     MCP-совместимый инструмент для gasless transfers на NEO N3.
@@ -20,7 +136,71 @@ class GaslessRelayTool:
     def __init__(self, config: 'NeoNetworkConfig'):
         self.config = config
         self.agent_acct = account.Account.from_wif(config.agent_wallet_wif)
-        self.rpc_client = noderpc.NeoRpcClient(config.rpc_url)
+        # HTTP-клиенты создаются лениво внутри event loop:
+        # aiohttp — для Neo RPC (HTTP/1.1), httpx с HTTP/2 — для Flamingo API
+        self._http: Optional[aiohttp.ClientSession] = None
+        self._flamingo_http: Optional[httpx.AsyncClient] = None
+        self.rpc_client = PooledNeoRpcClient(config.rpc_url, self._get_http)
+        # Кэш курсов Flamingo: (base, quote) -> (price, monotonic ts)
+        self._price_cache: Dict[Tuple[str, str], Tuple[float, float]] = {}
+        # Запросы курса "в полёте" — параллельные вызовы ждут один и тот же ответ
+        self._price_inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        # Кэш баланса GAS агента: (balance, monotonic ts) и текущий запрос обновления
+        self._gas_balance_cache: Optional[Tuple[float, float]] = None
+        self._gas_balance_task: Optional[asyncio.Task] = None
+        # Баланс GAS подтверждён выше минимума; пока False — переводы проверяют его сами
+        self._gas_ok = False
+        # Текущая проверка/пополнение GAS — общая для фонового цикла и переводов
+        self._gas_topup_task: Optional[asyncio.Task] = None
+        # Ограничение числа одновременных RPC-запросов к ноде
+        self._rpc_sem = asyncio.Semaphore(config.rpc_concurrency)
+        # Очередь на отправителя: его транзакции подписываются и отправляются последовательно
+        self._sender_locks: Dict[str, asyncio.Lock] = {}
+        self._sender_lock_users: Dict[str, int] = {}
+        # Идемпотентность по digest(intent, подпись): LRU результатов и отправки "в полёте"
+        self._intent_results: "OrderedDict[bytes, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self._intent_inflight: Dict[bytes, asyncio.Task] = {}
+
+    def _get_http(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.config.http_pool_limit,
+                ttl_dns_cache=300,
+                keepalive_timeout=60
+            )
+            self._http = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=5),
+                headers={"Connection": "keep-alive"}
+            )
+        return self._http
+
+    def _get_flamingo_http(self) -> httpx.AsyncClient:
+        # HTTP/2 мультиплексирует параллельные запросы курсов по одному TLS-соединению
+        if self._flamingo_http is None or self._flamingo_http.is_closed:
+            self._flamingo_http = httpx.AsyncClient(
+                http2=True,
+                timeout=5,
+                limits=httpx.Limits(max_keepalive_connections=20)
+            )
+        return self._flamingo_http
+
+    async def warmup(self):
+        """Прогреть DNS-кэш и keep-alive соединение с RPC-нодой до первого перевода"""
+        try:
+            async with self._rpc_sem:
+                await self.rpc_client.get_version()
+        except Exception as e:
+            print(f"⚠️ RPC warmup failed: {e}")
+
+    async def aclose(self):
+        """Закрыть HTTP-клиенты (вызывается при остановке MCP-сервера)"""
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
+        self._http = None
+        if self._flamingo_http is not None:
+            await self._flamingo_http.aclose()
+        self._flamingo_http = None
 
     # ────────────────────────────────────────────────
     # MCP Tool: estimate_gas_cost
@@ -45,13 +225,13 @@ class GaslessRelayTool:
         if price is None:
             raise RuntimeError("Failed to fetch price from Flamingo")
 
-        # 2. Расчёт: fee_in_asset = fee_gas / price
-        fee_in_asset = Decimal(str(fee_gas)) / Decimal(str(price))
-        fee_in_asset += fee_in_asset * Decimal(self.config.slippage_bps) / 10000  # буфер
+        # 2. Расчёт: fee_in_asset = fee_gas / price (+ буфер на проскальзывание).
+        # float точен до 8 знаков, Decimal здесь не нужен
+        fee_in_asset = (fee_gas / float(price)) * (1 + self.config.slippage_bps / 10000)
 
         # 3. Округлить до точности актива
         decimals = self._get_asset_decimals(asset_symbol)
-        fee_raw = int(fee_in_asset * (10 ** decimals))
+        fee_raw = int(fee_in_asset * 10 ** decimals + 0.5)
 
         return {
             "fee_in_asset": fee_raw,
@@ -88,9 +268,10 @@ class GaslessRelayTool:
             - intent_id: str
           returns: { "txid": str, "net_amount": int, "status": "sent" }
         """
-        net_amount = gross_amount - fee_in_asset
-
-        # 1. Проверить подпись пользователя
+        # Повтор того же подписанного intent (ретрай клиента, MCP replay) не должен порождать
+        # новую транзакцию: возвращаем сохранённый результат или ждём текущую отправку.
+        # Ключ — digest всего intent и подписи: запрос с другой подписью или параметрами
+        # не может ни занять, ни получить чужой результат
         intent_data = {
             "from": from_addr,
             "to": to_addr,
@@ -98,50 +279,108 @@ class GaslessRelayTool:
             "fee_in_asset": fee_in_asset,
             "intent_id": intent_id
         }
-        intent_json = json.dumps(intent_data, sort_keys=True)
-        user_pubkey = signing.recover_public_key_from_signature(
-            intent_json.encode(), bytes.fromhex(user_signature)
+        intent_bytes = canonical_intent_bytes(intent_data)
+        key = hashlib.sha256(intent_bytes + b"|" + user_signature.lower().encode()).digest()
+        cached = self._intent_results.get(key)
+        # Каждому вызывающему — своя копия результата, чтобы изменения у одного
+        # клиента не попадали в кэш и в ответы остальным
+        if cached is not None and time.monotonic() - cached[1] < self.config.intent_cache_ttl:
+            return dict(cached[0])
+
+        task = self._intent_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._execute_gasless_transfer(
+                from_addr, to_addr, asset_hash, gross_amount, fee_in_asset, user_signature, intent_id,
+                intent_bytes
+            ))
+            self._intent_inflight[key] = task
+            task.add_done_callback(lambda t: self._on_transfer_done(key, t))
+        return dict(await asyncio.shield(task))
+
+    def _on_transfer_done(self, key: bytes, task: asyncio.Task):
+        self._intent_inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return  # неудачные попытки не кэшируем — клиент может повторить
+        self._intent_results[key] = (dict(task.result()), time.monotonic())
+        self._intent_results.move_to_end(key)
+        while len(self._intent_results) > self.config.intent_cache_size:
+            self._intent_results.popitem(last=False)
+
+    async def _execute_gasless_transfer(
+        self,
+        from_addr: str,
+        to_addr: str,
+        asset_hash: str,
+        gross_amount: int,
+        fee_in_asset: int,
+        user_signature: str,
+        intent_id: str,
+        intent_bytes: bytes
+    ) -> Dict[str, Any]:
+        net_amount = gross_amount - fee_in_asset
+        # Байтовые представления нужны в нескольких местах — кодируем один раз
+        intent_id_bytes = intent_id.encode('utf-8')
+        sig_bytes = bytes.fromhex(user_signature)
+
+        # 1. Проверить подпись пользователя (intent_bytes уже канонизирован вызывающим)
+        # Восстановление ключа secp256r1 — CPU-bound, не блокируем event loop
+        user_pubkey = await asyncio.to_thread(
+            signing.recover_public_key_from_signature,
+            intent_bytes, sig_bytes
         )
-        user_script_hash = contract.Contract.create_signature_redeem_script(user_pubkey).to_array()
-        user_address = types.UInt160.deserialize_from_bytes(user_script_hash).to_address()
+        user_redeem_script = contract.Contract.create_signature_redeem_script(user_pubkey)
+        user_address = script_to_address(user_redeem_script)
 
         if user_address != from_addr:
             raise ValueError("Invalid user signature for intent")
 
-        # 2. Убедиться, что у агента есть GAS
-        await self._ensure_agent_has_gas()
-
-        # 3. Сформировать вызов контракта GaslessRelay
-        script = await self._build_relay_script(
+        # 2. Сформировать вызов контракта GaslessRelay и witness (чистые вычисления)
+        script = self._build_relay_script(
             from_addr=from_addr,
             to_addr=to_addr,
             asset_hash=asset_hash,
             net_amount=net_amount,
             burn_amount=fee_in_asset,
-            intent_id=intent_id
+            intent_id_bytes=intent_id_bytes
         )
-
-        # 4. Подготовить транзакцию
-        tx = payloads.Transaction(
-            version=0,
-            nonce=12345,
-            system_fee=120000,  # 0.0000012 GAS
-            network_fee=100000, # 0.000001 GAS
-            valid_until_block=999999,
-            attributes=[],
-            script=script,
-            witnesses=[]
+        witness = self._build_custom_witness(
+            from_addr, self.config.relay_contract_hash, intent_id_bytes, sig_bytes
         )
 
-        # 5. Подписать от имени агента (как witness)
-        witness = await self._build_custom_witness(from_addr, self.config.relay_contract_hash)
-        tx.witnesses = [witness]
+        # 3. Получить system fee и высоту. Баланс GAS агента поддерживает фоновая
+        # задача (gas_topup_loop); синхронно проверяем его, только если он на исходе —
+        # тогда оба RPC выполняются параллельно, а ошибка пополнения прерывает перевод.
+        if self._gas_ok:
+            system_fee, valid_until_block = await self._estimate_system_fee_and_vub(script)
+        else:
+            _, (system_fee, valid_until_block) = await asyncio.gather(
+                self._ensure_agent_has_gas(),
+                self._estimate_system_fee_and_vub(script)
+            )
+
+        # 4-7. Транзакции одного отправителя строим, подписываем и отправляем по очереди
+        async with self._sender_lock(from_addr):
+            # 4. Подготовить транзакцию
+            tx = payloads.Transaction(
+                version=0,
+                nonce=secrets.randbits(32),  # уникальный txid для одинаковых переводов
+                system_fee=system_fee,
+                network_fee=100000, # 0.000001 GAS
+                valid_until_block=valid_until_block,
+                attributes=[],
+                script=script,
+                witnesses=[]
+            )
 
-        # 6. Подписать TX приватным ключом агента
-        self.agent_acct.sign_tx(tx)
+            # 5. Подписать от имени агента (как witness)
+            tx.witnesses = [witness]
 
-        # 7. Отправить
-        txid = await self._send_raw_transaction(tx)
+            # 6. Подписать TX приватным ключом агента
+            self.agent_acct.sign_tx(tx)
+
+            # 7. Отправить
+            txid = await self._send_raw_transaction(tx)
+        self._debit_cached_gas_balance(tx.system_fee + tx.network_fee)
         return {
             "txid": txid,
             "net_amount": net_amount,
@@ -153,13 +392,59 @@ class GaslessRelayTool:
     # ────────────────────────────────────────────────
     # Вспомогательные методы
     # ────────────────────────────────────────────────
+    @asynccontextmanager
+    async def _sender_lock(self, from_addr: str):
+        """Сериализует переводы отправителя; lock удаляется, когда его никто не держит и не ждёт"""
+        lock = self._sender_locks.get(from_addr)
+        if lock is None:
+            lock = self._sender_locks[from_addr] = asyncio.Lock()
+        self._sender_lock_users[from_addr] = self._sender_lock_users.get(from_addr, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._sender_lock_users[from_addr] -= 1
+            if self._sender_lock_users[from_addr] == 0:
+                del self._sender_lock_users[from_addr]
+                del self._sender_locks[from_addr]
+
     async def _get_price_from_flamingo(self, base: str, quote: str) -> Optional[float]:
+        """Курс с TTL-кэшем; одновременные промахи по одной паре делят один HTTP-запрос"""
+        key = (base, quote)
+        cached = self._price_cache.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.config.price_cache_ttl:
+            return cached[0]
+
+        # Запрос принадлежит кэшу, а не первому вызывающему: отмена одного
+        # клиента не обрывает ожидание остальных
+        task = self._price_inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh_price(base, quote))
+            self._price_inflight[key] = task
+            task.add_done_callback(lambda t: self._price_inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _refresh_price(self, base: str, quote: str) -> Optional[float]:
+        price = await self._fetch_price_from_flamingo(base, quote)
+        if price is not None:
+            now = time.monotonic()
+            # Пары приходят от клиента — выбрасываем протухшие записи, чтобы кэш не рос
+            for k in [k for k, (_, ts) in self._price_cache.items()
+                      if now - ts >= self.config.price_cache_ttl]:
+                del self._price_cache[k]
+            self._price_cache[(base, quote)] = (price, now)
+        return price
+
+    async def _fetch_price_from_flamingo(self, base: str, quote: str) -> Optional[float]:
         url = f"{self.config.flamingo_api}/price"
         try:
-            resp = requests.get(url, params={"pair": f"{base}_{quote}"}, timeout=5)
+            resp = await self._get_flamingo_http().get(url, params={"pair": f"{base}_{quote}"})
             resp.raise_for_status()
             data = resp.json()
-            return float(data.get("price", 0))
+            price = float(data.get("price", 0))
+            if price <= 0:
+                raise ValueError(f"non-positive price {price!r} for {base}_{quote}")
+            return price
         except Exception as e:
             print(f"⚠️ Flamingo price fetch failed: {e}")
             return None
@@ -169,10 +454,72 @@ class GaslessRelayTool:
         return 8
 
     async def _ensure_agent_has_gas(self):
-        """Если GAS < min — сделать swap FLM → GAS"""
+        """
+        Если GAS < min — сделать swap FLM → GAS. Одновременные вызовы (фоновый цикл
+        и переводы) ждут одну и ту же проверку, поэтому swap выполняется один раз.
+        """
+        if self._gas_topup_task is None or self._gas_topup_task.done():
+            self._gas_topup_task = asyncio.create_task(self._top_up_agent_gas())
+            self._gas_topup_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        await asyncio.shield(self._gas_topup_task)
+
+    async def _top_up_agent_gas(self):
+        balance = await self._get_agent_gas_balance()
+        if balance >= self.config.min_agent_gas_balance:
+            self._gas_ok = True
+            return
+        self._gas_ok = False
+        await self._swap_flm_to_gas(target_gas=Decimal("0.01"))
+        # Результат swap виден только после включения в блок: сбрасываем кэш,
+        # а _gas_ok остаётся False до следующей проверки с достаточным балансом
+        self._gas_balance_cache = None
+
+    async def gas_topup_loop(self):
+        """Фоновое поддержание баланса GAS агента вне пути запроса (запускается MCP-сервером)"""
+        while True:
+            try:
+                await self._ensure_agent_has_gas()
+            except Exception as e:
+                self._gas_ok = False
+                print(f"⚠️ Gas top-up failed: {e}")
+            await asyncio.sleep(self.config.gas_topup_interval)
+
+    async def _get_agent_gas_balance(self) -> float:
+        """
+        Баланс GAS агента с кэшем на ~1 блок. Ближе к истечению TTL обновляется
+        в фоне; одновременные промахи ждут один и тот же RPC-запрос.
+        """
+        cached = self._gas_balance_cache
+        if cached is not None:
+            balance, ts = cached
+            age = time.monotonic() - ts
+            if age < self.config.gas_balance_cache_ttl:
+                if age > self.config.gas_balance_cache_ttl * 0.8:
+                    self._refresh_gas_balance()
+                return balance
+        return await asyncio.shield(self._refresh_gas_balance())
+
+    def _refresh_gas_balance(self) -> asyncio.Task:
+        if self._gas_balance_task is None or self._gas_balance_task.done():
+            self._gas_balance_task = asyncio.create_task(self._fetch_agent_gas_balance())
+            # Фоновое обновление никто не ждёт — забираем исключение, чтобы не было
+            # "Task exception was never retrieved"; неудачный запрос в кэш не попадает
+            self._gas_balance_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return self._gas_balance_task
+
+    async def _fetch_agent_gas_balance(self) -> float:
         balance = await self._get_gas_balance(self.agent_acct.script_hash)
-        if balance < self.config.min_agent_gas_balance:
-            await self._swap_flm_to_gas(target_gas=Decimal("0.01"))
+        self._gas_balance_cache = (balance, time.monotonic())
+        return balance
+
+    def _debit_cached_gas_balance(self, fee_raw: int):
+        """Учесть потраченные на транзакцию GAS в кэше, не дожидаясь RPC"""
+        if self._gas_balance_cache is not None:
+            balance, ts = self._gas_balance_cache
+            balance -= fee_raw / 1e8
+            self._gas_balance_cache = (balance, ts)
+            if balance < self.config.min_agent_gas_balance:
+                self._gas_ok = False
 
     async def _swap_flm_to_gas(self, target_gas: Decimal):
         # Пример запроса к Flamingo Swap API
@@ -182,7 +529,7 @@ class GaslessRelayTool:
             "amount": str(int(target_gas * 100 * 10**8)),  # ~100 FLM
             "recipient": self.agent_acct.address
         }
-        resp = requests.post(
+        resp = await self._get_flamingo_http().post(
             f"{self.config.flamingo_api}/swap",
             json=payload,
             headers={"Authorization": "Bearer YOUR_API_KEY"}
@@ -190,61 +537,65 @@ class GaslessRelayTool:
         resp.raise_for_status()
         print("✅ Swap executed:", resp.json().get("tx"))
 
-    async def _get_gas_balance(self, script_hash: types.UInt160) -> Decimal:
+    async def _get_gas_balance(self, script_hash: types.UInt160) -> float:
         # Запрос к RPC: invokefunction GasToken balanceOf
         # (реализация через neo3-python rpc client)
-        try:
+        # Ошибку RPC пробрасываем: 0.0 здесь выглядел бы как пустой баланс и запускал swap
+        async with self._rpc_sem:
             result = await self.rpc_client.invoke_function(
                 script_hash="0xd2a4cff31913016155e38e474a2c06d08be276cf",  # GAS Hash
                 operation="balanceOf",
                 args=[script_hash]
             )
-            balance_raw = int.from_bytes(result.state, 'little')
-            return Decimal(balance_raw) / 10**8
-        except Exception as e:
-            print(f"⚠️ RPC balance fetch failed: {e}")
-            return Decimal(0)
+        # Балансы GAS < 2^53, поэтому float сохраняет все 8 знаков
+        balance_raw = int.from_bytes(result.state, 'little')
+        return balance_raw / 1e8
 
-    async def _build_relay_script(self, from_addr: str, to_addr: str, asset_hash: str, net_amount: int, burn_amount: int, intent_id: str) -> bytes:
-        # Генерация script для вызова GaslessRelay.transferWithFeeFromAmount
-        # через neo3.vm
-        from neo3 import vm as vm_builder
-        from neo3.core import types, cryptography
+    def _build_relay_script(self, from_addr: str, to_addr: str, asset_hash: str, net_amount: int, burn_amount: int, intent_id_bytes: bytes) -> bytes:
+        # Генерация script для вызова GaslessRelay.transferWithFeeFromAmount.
+        # Аргументы эмитятся напрямую в bytearray (байт-в-байт как ScriptBuilder.emit_push)
 
         # 1. Десериализуем адреса в UInt160
         from_script_hash = types.UInt160.from_string(from_addr)
         to_script_hash = types.UInt160.from_string(to_addr)
         asset_script_hash = types.UInt160.from_string(asset_hash)
 
-        # 2. Собираем скрипт через vm_builder
+        # 2. Пушим аргументы в обратном порядке (стек)
+        buf = bytearray()
+        _emit_pushdata(buf, intent_id_bytes)              # string intent_id
+        _emit_pushint(buf, burn_amount)                   # long burn_amount
+        _emit_pushint(buf, net_amount)                    # long net_amount
+        _emit_uint160(buf, asset_script_hash)             # UInt160 asset_hash
+        _emit_uint160(buf, to_script_hash)                # UInt160 to_addr
+        _emit_uint160(buf, from_script_hash)              # UInt160 from_addr
+
+        # 3. Неизменная часть вызова System.Contract.Call — из кэша
+        buf += self._relay_call_suffix
+        return bytes(buf)
+
+    @cached_property
+    def _relay_call_suffix(self) -> bytes:
+        """
+        Хвост скрипта GaslessRelay.transferWithFeeFromAmount, не зависящий от аргументов:
+        CallFlags | 7 | PACK | method | contract hash | SYSCALL.
+        Считается один раз при первом переводе.
+        """
         builder = vm_builder.ScriptBuilder()
 
-        # 3. Пушим аргументы в обратном порядке (стек)
-        builder.emit_push(intent_id.encode('utf-8'))      # string intent_id
-        builder.emit_push(burn_amount)                    # long burn_amount
-        builder.emit_push(net_amount)                     # long net_amount
-        builder.emit_push(asset_script_hash)              # UInt160 asset_hash
-        builder.emit_push(to_script_hash)                 # UInt160 to_addr
-        builder.emit_push(from_script_hash)               # UInt160 from_addr
-
-        # 4. SysCall: вызов метода контракта
         # System.Contract.Call(contract_hash, method, call_flags, args[])
         builder.emit_push(0x00)  # CallFlags.All (0x00)
         builder.emit_push(7)     # количество аргументов
         builder.emit(vm_builder.OpCode.PACK)  # упаковываем 7 аргументов в массив
 
-        method_name = "transferWithFeeFromAmount"
-        builder.emit_push(method_name.encode('utf-8'))
+        builder.emit_push(RELAY_METHOD_NAME)
 
         contract_hash = types.UInt160.from_string(self.config.relay_contract_hash)
         builder.emit_push(contract_hash)
 
         builder.emit_syscall("System.Contract.Call")
-
-        # 5. Получить итоговый байтовый скрипт
         return builder.to_array()
 
-    async def _build_custom_witness(self, user_addr: str, contract_hash_str: str) -> payloads.Witness:
+    def _build_custom_witness(self, user_addr: str, contract_hash_str: str, intent_id_bytes: bytes, sig_bytes: bytes) -> payloads.Witness:
         # Создать witness с scope CustomContracts([contract_hash])
         # См. neo3/network/payloads/transaction.py
         # В NeoVM verification_script исполняется и должен вернуть true.
@@ -268,45 +619,60 @@ class GaslessRelayTool:
 
         # Это сложный NeoVM-скрипт. Давайте сгенерируем его через vm_builder.
 
-        builder = vm_builder.ScriptBuilder()
-
         # invocation_script: просто пушим подпись
         invocation_script_builder = vm_builder.ScriptBuilder()
-        # invocation_script_builder.emit_push(user_signature_bytes) # Предполагаем, что подпись уже в стеке или передаётся отдельно
+        invocation_script_builder.emit_push(sig_bytes)
 
-        # verification_script: вызов verify
+        # verification_script: вызов verify (собираем только изменяемый префикс)
         verification_script_builder = vm_builder.ScriptBuilder()
-        verification_script_builder.emit_push(intent_id.encode('utf-8'))
+        verification_script_builder.emit_push(intent_id_bytes)
         # signature будет из invocation_script -> берем с вершины стека
         verification_script_builder.emit(vm_builder.OpCode.DUP)  # копируем подпись
         verification_script_builder.emit_push(user_addr.encode('utf-8'))
-        verification_script_builder.emit_push("verify".encode('utf-8'))
-        verification_script_builder.emit_push(contract_hash_str.encode('utf-8'))
-        verification_script_builder.emit_push(0)  # CallFlags
-        verification_script_builder.emit_push(3)  # num args: user, sig, intent
-        verification_script_builder.emit(vm_builder.OpCode.PACK)
-        verification_script_builder.emit_syscall("System.Contract.Call")
-        verification_script_builder.emit(vm_builder.OpCode.ASSERT)
 
         return payloads.Witness(
             invocation_script=invocation_script_builder.to_array(),
-            verification_script=verification_script_builder.to_array()
+            verification_script=verification_script_builder.to_array() + verify_call_tail(contract_hash_str)
         )
 
-    async def _estimate_network_fee(self, tx: payloads.Transaction) -> int:
-        # Использовать RPC: invokescript → estimate fees
+    async def _estimate_system_fee_and_vub(self, script: bytes) -> Tuple[int, int]:
+        """
+        Один JSON-RPC batch: invokescript (system fee) + getblockcount (для valid_until_block).
+        Возвращает (system_fee, valid_until_block). Если нода недоступна или скрипт
+        завершается FAULT, бросает RuntimeError — такую транзакцию нельзя подписывать.
+        """
+        batch = [
+            {"jsonrpc": "2.0", "id": 1, "method": "invokescript",
+             "params": [base64.b64encode(script).decode()]},
+            {"jsonrpc": "2.0", "id": 2, "method": "getblockcount", "params": []},
+        ]
         try:
-            result = await self.rpc_client.invoke_script(tx.script)
-            return result.gas_consumed
+            async with self._rpc_sem, self._get_http().post(self.config.rpc_url, json=batch) as resp:
+                resp.raise_for_status()
+                responses = await resp.json()
+            by_id = {r["id"]: r for r in responses}
+            for r in by_id.values():
+                if "error" in r:
+                    raise RuntimeError(r["error"])
+            invoke = by_id[1]["result"]
+            block_count = int(by_id[2]["result"])
         except Exception as e:
             print(f"⚠️ Fee estimation failed: {e}")
-            return 100000  # fallback
+            raise RuntimeError(f"Fee estimation failed: {e}") from e
+
+        if invoke.get("state") != "HALT":
+            raise RuntimeError(
+                f"Relay script faulted in invokescript: {invoke.get('exception') or invoke.get('state')}"
+            )
+        system_fee = int(invoke["gasconsumed"])
+        return system_fee, block_count + self.config.valid_until_block_increment
 
     async def _send_raw_transaction(self, tx: payloads.Transaction) -> str:
         # Отправка в RPC: sendrawtransaction
         raw_tx = tx.to_array().hex()
         try:
-            result = await self.rpc_client.send_raw_transaction(raw_tx)
+            async with self._rpc_sem:
+                result = await self.rpc_client.send_raw_transaction(raw_tx)
             return result
         except Exception as e:
             print(f"⚠️ TX send failed: {e}")